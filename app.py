@@ -1,13 +1,18 @@
 import os
-import tempfile
-from typing import Dict, Any, List, Optional, Union
+import re
+import hashlib
+import functools
+from typing import Dict, Any, List, Optional, Tuple, Union
 from fastapi import FastAPI, UploadFile, File, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, Field, create_model
+from fastapi.responses import JSONResponse
 import uvicorn
+import orjson
 import asyncio
-import PyPDF2
-from cerebras.cloud.sdk import Cerebras
+import contextlib
+import pymupdf
+from cerebras.cloud.sdk import AsyncCerebras
+from cachetools import LRUCache
 import logging
 
 # Configure logging
@@ -15,13 +20,111 @@ logging.basicConfig(level=logging.INFO,
                    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Uploads larger than this are rejected. The multipart envelope around the file
+# (boundaries and part headers) is allowed a little slack on top.
+MAX_PDF_BYTES = int(os.environ.get("MAX_PDF_BYTES", str(20 * 1024 * 1024)))
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+UPLOAD_TOO_LARGE_DETAIL = f"File too large. Maximum size is {MAX_PDF_BYTES} bytes"
+
+class UploadTooLarge(Exception):
+    """Raised from the wrapped ASGI receive once a request body passes the size limit."""
+
+class UploadSizeLimitMiddleware:
+    """
+    ASGI middleware that answers 413 for /parse-cv bodies over the upload limit.
+    
+    A declared Content-Length is checked before anything is read. Otherwise the
+    body is counted as it arrives, so chunked uploads are cut off at the limit
+    instead of being spooled in full by the multipart parser.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.limit = MAX_PDF_BYTES + MULTIPART_OVERHEAD_BYTES
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] != "/parse-cv":
+            await self.app(scope, receive, send)
+            return
+
+        too_large_response = JSONResponse(status_code=413, content={"detail": UPLOAD_TOO_LARGE_DETAIL})
+        content_length = dict(scope["headers"]).get(b"content-length", b"")
+        if content_length.isdigit() and int(content_length) > self.limit:
+            await too_large_response(scope, receive, send)
+            return
+
+        received = 0
+        too_large = False
+        response_started = False
+
+        async def limited_receive():
+            nonlocal received, too_large
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.limit:
+                    too_large = True
+                    raise UploadTooLarge()
+            return message
+
+        async def guarded_send(message):
+            nonlocal response_started
+            # FastAPI reports a failed body read as a 400; answer with the 413 instead
+            if too_large:
+                return
+            response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except UploadTooLarge:
+            pass
+        if too_large and not response_started:
+            await too_large_response(scope, receive, send)
+
+# Check if Cerebras API key is set and create one shared client so connections are reused.
+# The SDK's own warm-up makes a blocking request on a throwaway sync client, which
+# doesn't help this client's pool; lifespan() below warms the real one instead.
+if os.environ.get("CEREBRAS_API_KEY"):
+    cerebras_client = AsyncCerebras(api_key=os.environ["CEREBRAS_API_KEY"], warm_tcp_connection=False)
+else:
+    cerebras_client = None
+    logger.warning("CEREBRAS_API_KEY environment variable not set. Using mock data for responses.")
+
+async def _warm_cerebras_connection():
+    """Opens the shared client's TLS connection with a cheap call that spends no tokens."""
+    try:
+        await cerebras_client.with_options(
+            timeout=2, max_retries=0, warm_tcp_connection=False
+        ).models.list()
+    except Exception as e:
+        logger.warning(f"Cerebras warm-up failed: {str(e)}")
+
+@contextlib.asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Warms the Cerebras connection in the background so startup never waits on the API."""
+    warmup_task = None
+    if cerebras_client is not None:
+        warmup_task = asyncio.create_task(_warm_cerebras_connection())
+    yield
+    # Don't leave the warm-up running past shutdown
+    if warmup_task is not None and not warmup_task.done():
+        warmup_task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await warmup_task
+
 # Initialize FastAPI app
 app = FastAPI(
     title="CV Parser API",
     description="API service to extract structured information from CVs in PDF format",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
+# Enforce the upload size limit; added before CORS so CORS headers wrap its 413s
+app.add_middleware(UploadSizeLimitMiddleware)
+
 # Add CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -31,40 +134,58 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Generic flexible model that can handle any structure
-class FlexibleModel(BaseModel):
-    class Config:
-        extra = "allow"  # Allow extra fields not defined in the model
-
-    def __init__(self, **data):
-        # Convert any nested dictionaries to FlexibleModels
-        for key, value in data.items():
-            if isinstance(value, dict):
-                data[key] = FlexibleModel(**value)
-            elif isinstance(value, list):
-                data[key] = [
-                    FlexibleModel(**item) if isinstance(item, dict) else item
-                    for item in value
-                ]
-        super().__init__(**data)
-
-    def dict(self, *args, **kwargs):
-        # Convert back to dict for JSON serialization
-        result = super().dict(*args, **kwargs)
-        return result
-
-# Use this as the response model
-class CVParseResponse(FlexibleModel):
-    pass
-
-# Check if Cerebras API key is set
-if not os.environ.get("CEREBRAS_API_KEY"):
-    logger.warning("CEREBRAS_API_KEY environment variable not set. Using mock data for responses.")
+# Tokens the JSON brace scanner cares about: escape sequences, quotes and braces.
+# finditer skips every other character in C instead of in the Python loop.
+JSON_TOKEN_RE = re.compile(r'\\.|[{}"]', re.DOTALL)
+
+# Extracted PDF text keyed by a hash of the file bytes, so re-uploads skip parsing.
+# Bounded by total characters of cached text rather than entry count.
+PDF_TEXT_CACHE_CHARS = int(os.environ.get("PDF_TEXT_CACHE_CHARS", str(8 * 1024 * 1024)))
+pdf_text_cache: LRUCache = LRUCache(maxsize=PDF_TEXT_CACHE_CHARS, getsizeof=len)
 
-# Function to extract text from PDF files using PyPDF2
-async def extract_text_from_pdf(file_content: bytes) -> str:
+# LLM prompts; the CV text is appended to CV_PARSE_PROMPT, capped at MAX_CV_CHARS
+MAX_CV_CHARS = int(os.environ.get("MAX_CV_CHARS", "32000"))
+SYSTEM_PROMPT = "You are an expert CV parser that outputs only valid JSON."
+CV_PARSE_PROMPT = (
+    "Extract ALL information from the CV below as one RFC8259 JSON object. "
+    "Use whatever sections the CV contains (e.g. personal info, summary, experience, "
+    "education, skills, projects, certifications, languages, awards) and capture "
+    "every detail in a structured form. Output ONLY the JSON.\n\n"
+    "CV Text:\n"
+)
+
+# Parsed LLM responses keyed by a hash of the CV text, so resubmitted CVs skip the LLM call
+llm_cache: LRUCache = LRUCache(maxsize=int(os.environ.get("LLM_CACHE_SIZE", "1024")))
+
+# LLM calls currently in progress, keyed like llm_cache, so simultaneous duplicates share one call
+llm_inflight: Dict[str, asyncio.Task] = {}
+
+async def read_upload(file: UploadFile) -> bytearray:
     """
-    Asynchronously extracts text content from a PDF file.
+    Reads an uploaded file in chunks, enforcing MAX_PDF_BYTES.
+    
+    Args:
+        file: The uploaded file
+        
+    Returns:
+        Raw bytes of the file, as the buffer they were read into (not copied)
+    """
+    too_large = HTTPException(status_code=413, detail=UPLOAD_TOO_LARGE_DETAIL)
+    # Cheap early exit when the size is already known
+    if file.size is not None and file.size > MAX_PDF_BYTES:
+        raise too_large
+
+    buffer = bytearray()
+    while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+        buffer.extend(chunk)
+        if len(buffer) > MAX_PDF_BYTES:
+            raise too_large
+    return buffer
+
+# Function to extract text from PDF files using PyMuPDF
+def _extract_text_from_pdf_sync(file_content: Union[bytes, bytearray]) -> str:
+    """
+    Extracts text content from a PDF file. Blocking, run it off the event loop.
     
     Args:
         file_content: Raw bytes of the PDF file
@@ -72,30 +193,172 @@ async def extract_text_from_pdf(file_content: bytes) -> str:
     Returns:
         Extracted text as a string
     """
+    # PyMuPDF opens the document straight from memory, no temporary file needed
+    doc = pymupdf.open(stream=file_content, filetype="pdf")
     try:
-        with tempfile.NamedTemporaryFile(delete=False) as temp_file:
-            temp_file.write(file_content)
-            temp_file_path = temp_file.name
-
-        text = ""
-        with open(temp_file_path, 'rb') as file:
-            pdf_reader = PyPDF2.PdfReader(file)
-            for page_num in range(len(pdf_reader.pages)):
-                page = pdf_reader.pages[page_num]
-                text += page.extract_text()
+        # Most CVs are a single page: read it directly, skipping the join machinery
+        if doc.page_count == 1:
+            return doc[0].get_text("text")
+        return "".join(page.get_text("text") for page in doc)
+    finally:
+        doc.close()
+
+def _pdf_cache_key(file_content: Union[bytes, bytearray]) -> bytes:
+    """Returns the pdf_text_cache key for an upload."""
+    return hashlib.blake2b(file_content, digest_size=16).digest()
+
+async def extract_text_from_pdf(file_content: Union[bytes, bytearray]) -> str:
+    """
+    Asynchronously extracts text content from a PDF file.
+    
+    Args:
+        file_content: Raw bytes of the PDF file
         
-        # Clean up the temporary file
-        os.unlink(temp_file_path)
-        return text
+    Returns:
+        Extracted text as a string
+    """
+    # Hashing a large upload takes tens of milliseconds, so keep it off the event loop too
+    cache_key = await asyncio.to_thread(_pdf_cache_key, file_content)
+    cached = pdf_text_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    try:
+        # Parsing is CPU-bound, so keep it in a worker thread to avoid stalling other requests
+        text = await asyncio.to_thread(_extract_text_from_pdf_sync, file_content)
     except Exception as e:
         logger.error(f"Error extracting text from PDF: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error extracting text from PDF: {str(e)}")
 
+    # A single text larger than the whole budget can't be cached
+    if len(text) <= PDF_TEXT_CACHE_CHARS:
+        pdf_text_cache[cache_key] = text
+    return text
+
+def _extract_json_object(text: str, start: int = 0) -> Optional[str]:
+    """
+    Finds the first complete JSON object at or after start in a single pass.
+    
+    Tracks brace depth while skipping over string literals (including escaped
+    quotes), so braces inside values don't end the object early. Only the
+    structural tokens are visited, the text in between is skipped by the regex engine.
+    
+    Args:
+        text: Raw LLM output that may wrap the JSON in prose or markdown
+        start: Index to start searching for '{' from
+        
+    Returns:
+        The substring from the first '{' to its matching '}', or None if there is no balanced object
+    """
+    start = text.find("{", start)
+    if start == -1:
+        return None
+
+    depth = 0
+    in_string = False
+    for match in JSON_TOKEN_RE.finditer(text, start):
+        token = match.group()
+        if token == '"':
+            in_string = not in_string
+        elif in_string:
+            # Braces and escape sequences inside strings don't count
+            continue
+        elif token == "{":
+            depth += 1
+        elif token == "}":
+            depth -= 1
+            if depth == 0:
+                return text[start:match.end()]
+    return None
+
+def _salvage_json_object(text: str) -> Optional[Dict[str, Any]]:
+    """
+    Parses the first embedded top-level JSON object that actually decodes.
+    
+    A balanced but invalid candidate (e.g. "{note}" in leading prose) doesn't end
+    the search; scanning resumes after its closing '}', never inside it, so a
+    nested fragment is never mistaken for the whole CV and the scan stays linear.
+    An object that never closes means the output was cut off, so nothing is salvaged.
+    
+    Args:
+        text: Raw LLM output that may wrap the JSON in prose or markdown
+        
+    Returns:
+        The decoded object, or None if no candidate is a valid JSON object
+    """
+    start = text.find("{")
+    while start != -1:
+        json_text = _extract_json_object(text, start)
+        if json_text is None:
+            return None
+        try:
+            value = orjson.loads(json_text)
+        except orjson.JSONDecodeError:
+            value = None
+        if isinstance(value, dict):
+            return value
+        start = text.find("{", start + len(json_text))
+    return None
+
+async def _request_llm_parse(cv_text: str) -> Tuple[Dict[str, Any], bool]:
+    """
+    Sends one CV to the LLM and parses the JSON it returns.
+    
+    Args:
+        cv_text: Normalized CV text
+        
+    Returns:
+        Parsed CV data as a dictionary, and whether it may be cached
+        (False when it had to be salvaged from malformed output)
+    """
+    # Create the prompt
+    prompt = f"{CV_PARSE_PROMPT}{cv_text}"
+    
+    # Generate response using Cerebras
+    chat_completion = await cerebras_client.chat.completions.create(
+        model="llama3.1-8b",  # or "llama-3.3-70b" if you prefer
+        messages=[
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": prompt}
+        ],
+        # JSON mode makes the model emit a bare JSON object, so no markdown to strip
+        response_format={"type": "json_object"},
+    )
+    
+    # Extract the JSON content from the response
+    content = chat_completion.choices[0].message.content
+    
+    # Convert string to dictionary if needed
+    cacheable = True
+    if isinstance(content, str):
+        try:
+            content = orjson.loads(content)
+        except orjson.JSONDecodeError:
+            # Last resort if the model still wraps the object in extra text; a
+            # salvaged result isn't cached so a retry gets a fresh answer
+            content = _salvage_json_object(content)
+            cacheable = False
+            if content is None:
+                raise HTTPException(status_code=500, detail="Failed to parse LLM response as JSON")
+    
+    return content, cacheable
+
+def _finish_llm_task(cache_key: str, task: asyncio.Task) -> None:
+    """Done-callback for shared LLM calls: caches the result even if every waiter has gone."""
+    llm_inflight.pop(cache_key, None)
+    if task.cancelled():
+        return
+    # Retrieving the exception here also stops asyncio warning about it when nobody awaited
+    if task.exception() is None:
+        content, cacheable = task.result()
+        if cacheable:
+            llm_cache[cache_key] = content
+
 async def parse_cv_with_llm(cv_text: str) -> Dict[str, Any]:
     """Parse CV text using LLM to extract structured information."""
     try:
         # Check if Cerebras API key is set
-        if not os.environ.get("CEREBRAS_API_KEY"):
+        if cerebras_client is None:
             # Return mock data for testing without API key
             return {
                 "name": "John Doe",
@@ -134,75 +397,28 @@ async def parse_cv_with_llm(cv_text: str) -> Dict[str, Any]:
                 "certifications": ["AWS Certified Developer", "Scrum Master"]
             }
 
-        # Initialize Cerebras client
-        client = Cerebras(api_key=os.environ.get("CEREBRAS_API_KEY"))
-        
-        # Create the prompt
-        prompt = f"""
-        You are an expert CV parser. Extract ALL important information from the following CV text.
-        Analyze the CV thoroughly and identify ALL relevant sections and details.
-
-        Return a RFC8259 compliant JSON object that captures the complete structure of the CV.
-        Do not limit yourself to predefined sections - extract whatever sections and information are present in the CV.
-
-        Common sections might include (but are not limited to):
-        - Personal information (name, contact details)
-        - Summary or objective
-        - Work experience
-        - Education
-        - Skills or competencies
-        - Projects
-        - Publications
-        - Certifications
-        - Languages
-        - Volunteer work
-        - Awards and honors
-        - References
-        - Additional sections specific to this CV
-
-        For each section, capture all relevant details in a structured format.
-        Ensure your response is ONLY valid JSON with no additional text or explanation.
-
-        CV Text:
-        {cv_text}
-        """
-        
-        # Generate response using Cerebras
-        chat_completion = client.chat.completions.create(
-            model="llama3.1-8b",  # or "llama-3.3-70b" if you prefer
-            messages=[
-                {"role": "system", "content": "You are an expert CV parser that outputs only valid JSON."},
-                {"role": "user", "content": prompt}
-            ],
-        )
-        
-        # Extract the JSON content from the response
-        content = chat_completion.choices[0].message.content
-        
-        # Convert string to dictionary if needed
-        if isinstance(content, str):
-            import json
-            try:
-                content = json.loads(content)
-            except json.JSONDecodeError:
-                # If the response is not valid JSON, try to extract JSON part
-                import re
-                json_match = re.search(r'```json\n(.*?)\n```', content, re.DOTALL)
-                if json_match:
-                    content = json.loads(json_match.group(1))
-                else:
-                    # Try another pattern without language specification
-                    json_match = re.search(r'```\n(.*?)\n```', content, re.DOTALL)
-                    if json_match:
-                        content = json.loads(json_match.group(1))
-                    else:
-                        # Try to find JSON-like content with curly braces
-                        json_match = re.search(r'\{.*\}', content, re.DOTALL)
-                        if json_match:
-                            content = json.loads(json_match.group(0))
-                        else:
-                            raise HTTPException(status_code=500, detail="Failed to parse LLM response as JSON")
-        
+        # Collapse runs of spaces and drop blank lines, keeping the line breaks
+        # that separate roles, dates and columns
+        cv_text = "\n".join(" ".join(line.split()) for line in cv_text.splitlines() if line.strip())
+        # Cap pathological CVs to keep the prompt small
+        if len(cv_text) > MAX_CV_CHARS:
+            logger.warning(f"CV text truncated from {len(cv_text)} to {MAX_CV_CHARS} characters")
+            cv_text = cv_text[:MAX_CV_CHARS]
+
+        # Serve duplicate CVs from the cache
+        cache_key = hashlib.sha256(cv_text.encode("utf-8")).hexdigest()
+        cached = llm_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+        # Share one LLM call between concurrent requests for the same CV
+        task = llm_inflight.get(cache_key)
+        if task is None:
+            task = asyncio.create_task(_request_llm_parse(cv_text))
+            llm_inflight[cache_key] = task
+            task.add_done_callback(functools.partial(_finish_llm_task, cache_key))
+        # Shield so one waiter being cancelled doesn't cancel the call shared with the others
+        content, _ = await asyncio.shield(task)
         return content
     
     except Exception as e:
@@ -210,7 +426,7 @@ async def parse_cv_with_llm(cv_text: str) -> Dict[str, Any]:
         raise HTTPException(status_code=500, detail=f"Error parsing CV with LLM: {str(e)}")
 
 @app.post("/parse-cv")
-async def parse_cv(file: UploadFile = File(...)):
+async def parse_cv(file: UploadFile = File(...)) -> Dict[str, Any]:
     """
     Parse a CV in PDF format and extract structured information.
     
@@ -221,8 +437,12 @@ async def parse_cv(file: UploadFile = File(...)):
     if file.content_type != "application/pdf":
         raise HTTPException(status_code=400, detail="Only PDF files are supported")
     
-    # Read file content
-    file_content = await file.read()
+    # Read file content, rejecting oversized uploads
+    file_content = await read_upload(file)
+    
+    # The Content-Type header is client-supplied, so confirm the PDF signature too
+    if not file_content.startswith(b"%PDF-"):
+        raise HTTPException(status_code=400, detail="Uploaded file is not a valid PDF")
     
     # Extract text from PDF
     cv_text = await extract_text_from_pdf(file_content)
@@ -242,9 +462,18 @@ async def parse_cv(file: UploadFile = File(...)):
         )
 
 @app.get("/health")
-async def health_check():
+async def health_check() -> Dict[str, str]:
     """Health check endpoint to verify the API is running."""
     return {"status": "healthy"}
 
 if __name__ == "__main__":
-    uvicorn.run("app:app", host="0.0.0.0", port=8000, reload=True) 
\ No newline at end of file
+    if os.environ.get("DEV") == "1":
+        uvicorn.run("app:app", host="0.0.0.0", port=8000, reload=True)
+    else:
+        # uvicorn picks uvloop and httptools automatically when uvicorn[standard] is installed
+        uvicorn.run(
+            "app:app",
+            host="0.0.0.0",
+            port=8000,
+            workers=int(os.environ.get("WEB_CONCURRENCY", "2"))
+        ) 
\ No newline at end of file
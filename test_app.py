@@ -0,0 +1,115 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+
+import app
+
+
+TRUNCATED = '{"name": "Jane", "experience": [{"company": "A"}, {"company": "B", "ro'
+
+
+class StubCompletions:
+    """Stands in for the Cerebras chat completions API, returning a fixed reply."""
+
+    def __init__(self, content: str):
+        self.content = content
+        self.calls = 0
+
+    async def create(self, **kwargs):
+        self.calls += 1
+        message = SimpleNamespace(content=self.content)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+
+@pytest.fixture
+def llm_reply(monkeypatch):
+    """Installs a stub Cerebras client whose reply is set by the test."""
+    app.llm_cache.clear()
+    app.llm_inflight.clear()
+
+    def install(content: str) -> StubCompletions:
+        completions = StubCompletions(content)
+        monkeypatch.setattr(app, "cerebras_client", SimpleNamespace(chat=SimpleNamespace(completions=completions)))
+        return completions
+
+    yield install
+    app.llm_cache.clear()
+
+
+def test_salvage_skips_prose_braces_before_the_object():
+    assert app._salvage_json_object('pre {note} then {"a": 1}') == {"a": 1}
+
+
+def test_salvage_reads_fenced_block():
+    text = 'Here you go:\n```json\n{"a": "}{", "b": {"c": 1}}\n```\n'
+    assert app._salvage_json_object(text) == {"a": "}{", "b": {"c": 1}}
+
+
+def test_salvage_rejects_truncated_output():
+    # The nested {"company": "A"} must not be returned as if it were the whole CV
+    assert app._salvage_json_object(TRUNCATED) is None
+
+
+def test_salvage_does_not_descend_into_invalid_candidate():
+    assert app._salvage_json_object('{bad {"a": 1}}') is None
+
+
+def test_salvage_stays_linear_on_unclosed_objects():
+    assert app._salvage_json_object('{"a":' * 3000) is None
+
+
+def test_truncated_llm_output_is_an_error_and_not_cached(llm_reply):
+    llm_reply(TRUNCATED)
+    with pytest.raises(HTTPException) as excinfo:
+        asyncio.run(app.parse_cv_with_llm("Jane Roe"))
+    assert excinfo.value.status_code == 500
+    assert len(app.llm_cache) == 0
+
+
+def test_salvaged_result_is_returned_but_not_cached(llm_reply):
+    completions = llm_reply('pre {note} then {"name": "Jane"}')
+    assert asyncio.run(app.parse_cv_with_llm("Jane Roe")) == {"name": "Jane"}
+    assert len(app.llm_cache) == 0
+    asyncio.run(app.parse_cv_with_llm("Jane Roe"))
+    assert completions.calls == 2
+
+
+def test_valid_result_is_cached(llm_reply):
+    completions = llm_reply('{"name": "Jane"}')
+    assert asyncio.run(app.parse_cv_with_llm("Jane Roe")) == {"name": "Jane"}
+    assert asyncio.run(app.parse_cv_with_llm("Jane  Roe\n")) == {"name": "Jane"}
+    assert completions.calls == 1
+
+
+ORIGIN = {"Origin": "http://example.com"}
+OVERSIZED = app.MAX_PDF_BYTES + app.MULTIPART_OVERHEAD_BYTES + 1
+
+
+def test_upload_over_content_length_limit_is_413_with_cors_headers():
+    client = TestClient(app.app)
+    files = {"file": ("cv.pdf", b"%PDF-" + b"0" * OVERSIZED, "application/pdf")}
+    response = client.post("/parse-cv", files=files, headers=ORIGIN)
+    assert response.status_code == 413
+    assert response.headers["access-control-allow-origin"] == "http://example.com"
+
+
+def test_chunked_upload_over_limit_is_413_with_cors_headers():
+    def body():
+        yield b'--XyZ\r\nContent-Disposition: form-data; name="file"; filename="cv.pdf"\r\n'
+        yield b"Content-Type: application/pdf\r\n\r\n%PDF-"
+        for _ in range(OVERSIZED // 65536 + 1):
+            yield b"0" * 65536
+        yield b"\r\n--XyZ--\r\n"
+
+    client = TestClient(app.app)
+    headers = {**ORIGIN, "Content-Type": "multipart/form-data; boundary=XyZ"}
+    response = client.post("/parse-cv", content=body(), headers=headers)
+    assert response.status_code == 413
+    assert response.headers["access-control-allow-origin"] == "http://example.com"
+
+
+def test_health_passes_through_upload_limit():
+    assert TestClient(app.app).get("/health").json() == {"status": "healthy"}